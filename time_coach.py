@@ -1,5 +1,10 @@
 import os
-import json
+import time
+import random
+from functools import lru_cache
+from itertools import accumulate
+from operator import itemgetter
+import orjson
 import streamlit as st
 import datetime
 from datetime import timedelta
@@ -7,21 +12,45 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
-import pytz
+from zoneinfo import ZoneInfo
+from sortedcontainers import SortedKeyList
 
 # --- Constants ---
 SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
 TASKS_FILE = 'tasks.json'
 TIMEZONE = 'America/New_York'  # Change to your timezone
-calendar_events = []
+_TZ = ZoneInfo(TIMEZONE)
+_CATEGORY_COLORS = {
+    "Work": "#4285F4",
+    "Personal": "#EA4335",
+    "Health": "#34A853",
+    "Learning": "#FBBC05",
+    "Other": "#9E9E9E"
+}
+_DEFAULT_COLOR = "#9E9E9E"
+
+# One decode shared by every session; invalidated whenever the file is
+# rewritten
+@st.cache_resource
+def _load_tasks_from_disk():
+    if os.path.exists(TASKS_FILE):
+        with open(TASKS_FILE, 'rb') as f:
+            return orjson.loads(f.read())
+    return []
 
 # --- Initialize Session State ---
 if "tasks" not in st.session_state:
-    if os.path.exists(TASKS_FILE):
-        with open(TASKS_FILE, 'r') as f:
-            st.session_state.tasks = json.load(f)
-    else:
-        st.session_state.tasks = []
+    # Copy per task so one session's edits don't mutate the shared
+    # cached list
+    st.session_state.tasks = [dict(task) for task in _load_tasks_from_disk()]
+
+if "calendar_events" not in st.session_state:
+    st.session_state.calendar_events = []
+
+if "tasks_version" not in st.session_state:
+    # Random seed keeps the cache key unique per session; st.cache_data
+    # is shared across sessions
+    st.session_state.tasks_version = random.getrandbits(48)
 
 if "day_start_hour" not in st.session_state:
     st.session_state.day_start_hour = 8
@@ -33,7 +62,10 @@ if "buffer_minutes" not in st.session_state:
     st.session_state.buffer_minutes = 5
 
 # --- Google Calendar API Integration ---
-def get_google_calendar_events():
+# The built service is reused for the whole session; constructing it
+# refetches the API discovery document, which dominates fetch latency
+@st.cache_resource
+def _calendar_service():
     creds = None
     if os.path.exists('token.json'):
         creds = Credentials.from_authorized_user_file('token.json', SCOPES)
@@ -47,22 +79,50 @@ def get_google_calendar_events():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
 
-    service = build('calendar', 'v3', credentials=creds)
+    return build('calendar', 'v3', credentials=creds)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_events(now_bucket):
+    service = _calendar_service()
     now = datetime.datetime.utcnow().isoformat() + 'Z'
     end_of_day = (datetime.datetime.utcnow() + timedelta(hours=24)).isoformat() + 'Z'
 
     events_result = service.events().list(
         calendarId='primary', timeMin=now, timeMax=end_of_day,
-        maxResults=20, singleEvents=True,
-        orderBy='startTime').execute()
+        maxResults=20, singleEvents=True, orderBy='startTime',
+        fields='items(start,end,summary)').execute()
 
-    events = events_result.get('items', [])
-    return sorted(events, key=lambda e: e['start'].get('dateTime', e['start'].get('date')))
+    return events_result.get('items', [])
+
+def get_google_calendar_events():
+    # Bucket the clock to 5-minute steps so repeated fetches inside a
+    # window share one API round-trip
+    now = datetime.datetime.utcnow()
+    now_bucket = now.replace(minute=now.minute - now.minute % 5,
+                             second=0, microsecond=0).isoformat()
+    # orderBy='startTime' means the items arrive already sorted
+    return _fetch_events(now_bucket)
 
 # --- Task Management ---
+def _flush_tasks():
+    # Write to a temp file and rename so a crash mid-write can't
+    # truncate tasks.json
+    tmp_file = TASKS_FILE + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(orjson.dumps(st.session_state.tasks))
+    os.replace(tmp_file, TASKS_FILE)
+    _load_tasks_from_disk.clear()
+    st.session_state.tasks_dirty = False
+    st.session_state.last_flush = time.monotonic()
+
 def save_tasks():
-    with open(TASKS_FILE, 'w') as f:
-        json.dump(st.session_state.tasks, f, default=str)
+    st.session_state.tasks_version += 1
+    # Debounce bursts of edits: skip the disk write if we flushed less
+    # than half a second ago; the pending state is picked up at the end
+    # of the next rerun
+    st.session_state.tasks_dirty = True
+    if time.monotonic() - st.session_state.get('last_flush', 0.0) >= 0.5:
+        _flush_tasks()
 
 def add_task(title, priority, duration_minutes, category="General"):
     task = {
@@ -73,6 +133,8 @@ def add_task(title, priority, duration_minutes, category="General"):
         "scheduled": False,
         "start_time": None,
         "end_time": None,
+        "start_hhmm": None,
+        "end_hhmm": None,
         "completed": False
     }
     st.session_state.tasks.append(task)
@@ -83,94 +145,150 @@ def delete_task(index):
     save_tasks()
 
 def edit_task(index, new_title, new_priority, new_duration, new_category):
-    st.session_state.tasks[index]["title"] = new_title
-    st.session_state.tasks[index]["priority"] = new_priority
-    st.session_state.tasks[index]["duration"] = new_duration
-    st.session_state.tasks[index]["category"] = new_category
-    save_tasks()
+    task = st.session_state.tasks[index]
+    changes = {key: value for key, value in (("title", new_title),
+                                             ("priority", new_priority),
+                                             ("duration", new_duration),
+                                             ("category", new_category))
+               if task[key] != value}
+    # Saving the form without touching anything shouldn't rewrite the file
+    if changes:
+        task.update(changes)
+        save_tasks()
 
 def toggle_task_completion(index):
     st.session_state.tasks[index]["completed"] = not st.session_state.tasks[index]["completed"]
     save_tasks()
 
+# Repeated reruns format the same timestamps over and over; cache the
+# parse + format for tasks that predate the stored hhmm fields
+@lru_cache(maxsize=4096)
+def _fmt_hhmm(iso):
+    return datetime.datetime.fromisoformat(iso).strftime('%H:%M')
+
+# Cached on the task-list version so reruns that don't touch the tasks
+# skip the sort entirely; returns indices so callers keep working with
+# the live task dicts rather than cache copies
+@st.cache_data(show_spinner=False)
+def _prioritized_order(version, _tasks):
+    pending = [(task["priority"], -task["duration"], i)
+               for i, task in enumerate(_tasks) if not task["completed"]]
+    pending.sort()
+    return [i for _, _, i in pending]
+
 def get_prioritized_tasks():
-    return sorted([task for task in st.session_state.tasks if not task["completed"]], 
-                 key=lambda x: (x["priority"], -x["duration"]))
+    tasks = st.session_state.tasks
+    return [tasks[i] for i in _prioritized_order(st.session_state.tasks_version, tasks)]
+
+# Sweep sorted busy spans (epoch seconds) and return the gaps between
+# them: the gap before each span starts at the running maximum end of
+# everything earlier, which also merges overlapping spans away
+def _free_gaps(busy, day_start_ts, day_end_ts):
+    running_end = accumulate((end for _, end in busy), max, initial=day_start_ts)
+    next_start = [start for start, _ in busy]
+    next_start.append(day_end_ts)
+    return [(gap_start, gap_end)
+            for gap_start, gap_end in zip(running_end, next_start)
+            if gap_start < gap_end]
 
 def find_free_slots(events, day_start, day_end):
-    busy_slots = []
-    for event in events:
-        start_str = event['start'].get('dateTime')
-        end_str = event['end'].get('dateTime')
-        if start_str and end_str:
-            start = datetime.datetime.fromisoformat(start_str[:-1]).astimezone(pytz.timezone(TIMEZONE))
-            end = datetime.datetime.fromisoformat(end_str[:-1]).astimezone(pytz.timezone(TIMEZONE))
-            busy_slots.append((start, end))
-
-    busy_slots.sort()
-    free_slots = []
-    current = day_start
-
-    for start, end in busy_slots:
-        if current < start:
-            free_slots.append((current, start))
-        current = max(current, end)
-
-    if current < day_end:
-        free_slots.append((current, day_end))
-
-    return free_slots
+    # Convert to plain epoch seconds at the boundary so the sweep itself
+    # compares numbers instead of datetime objects
+    busy = [
+        (datetime.datetime.fromisoformat(start_str.replace('Z', '+00:00')).timestamp(),
+         datetime.datetime.fromisoformat(end_str.replace('Z', '+00:00')).timestamp())
+        for start_str, end_str in ((event['start'].get('dateTime'), event['end'].get('dateTime'))
+                                   for event in events)
+        if start_str and end_str
+    ]
+
+    # Events arrive ordered by start time, so the sweep can usually run
+    # directly; sort only if an out-of-order pair sneaks in
+    if any(busy[i] > busy[i + 1] for i in range(len(busy) - 1)):
+        busy.sort()
+
+    return [(datetime.datetime.fromtimestamp(gap_start, _TZ),
+             datetime.datetime.fromtimestamp(gap_end, _TZ))
+            for gap_start, gap_end in _free_gaps(busy, day_start.timestamp(), day_end.timestamp())]
 
 def schedule_tasks():
-    day_start = datetime.datetime.combine(datetime.date.today(), 
-                                        datetime.time(st.session_state.day_start_hour, 0)).astimezone(pytz.timezone(TIMEZONE))
-    day_end = datetime.datetime.combine(datetime.date.today(), 
-                                      datetime.time(st.session_state.day_end_hour, 0)).astimezone(pytz.timezone(TIMEZONE))
+    # Build the day window directly in the target timezone instead of
+    # reinterpreting server-local wall clock
+    day_start = datetime.datetime.combine(datetime.date.today(),
+                                        datetime.time(st.session_state.day_start_hour, 0), tzinfo=_TZ)
+    day_end = datetime.datetime.combine(datetime.date.today(),
+                                      datetime.time(st.session_state.day_end_hour, 0), tzinfo=_TZ)
     
-    if not calendar_events:
+    if not st.session_state.calendar_events:
         st.warning("No calendar events found to schedule around")
         return
-    
-    free_slots = find_free_slots(calendar_events, day_start, day_end)
-    free_slots.sort(key=lambda slot: (slot[1] - slot[0]), reverse=True)
-    
+
+    # Free slots kept sorted by duration so each task takes the smallest
+    # slot that still fits (best fit, O(log S) per lookup)
+    free_slots = SortedKeyList(find_free_slots(st.session_state.calendar_events, day_start, day_end),
+                               key=lambda slot: slot[1] - slot[0])
+
     buffer_time = timedelta(minutes=st.session_state.buffer_minutes)
-    
-    for task in get_prioritized_tasks():
-        if task["scheduled"]:
-            continue
-            
+
+    pending = [task for task in get_prioritized_tasks() if not task["scheduled"]]
+
+    # A slot tail shorter than the smallest pending task can never be
+    # used again this pass, so it is dropped instead of reinserted and
+    # the slot list stays compact
+    min_needed = None
+    if pending:
+        min_needed = timedelta(minutes=min(task["duration"] for task in pending)) + buffer_time
+
+    # Slot lengths only shrink as tasks are placed, so once a duration
+    # fails to fit we can reject any equal-or-longer task outright
+    # instead of bisecting again
+    too_big = None
+
+    for task in pending:
         task_duration = timedelta(minutes=task["duration"]) + buffer_time
-        
-        for i, (start, end) in enumerate(free_slots):
-            slot_duration = end - start
-            if task_duration <= slot_duration:
-                task["scheduled"] = True
-                task["start_time"] = start.isoformat()
-                task["end_time"] = (start + task_duration).isoformat()
-                
-                # Update the free slot
-                new_start = start + task_duration
-                free_slots[i] = (new_start, end)
-                if new_start >= end:
-                    del free_slots[i]
-                break
-                
+        if too_big is not None and task_duration >= too_big:
+            continue
+
+        i = free_slots.bisect_key_left(task_duration)
+        if i == len(free_slots):
+            too_big = task_duration
+            continue
+
+        start, end = free_slots.pop(i)
+        task_end = start + task_duration
+        task["scheduled"] = True
+        task["start_time"] = start.isoformat()
+        task["end_time"] = task_end.isoformat()
+        # Formatted once here so reruns render without re-parsing ISO strings
+        task["start_hhmm"] = start.strftime('%H:%M')
+        task["end_hhmm"] = task_end.strftime('%H:%M')
+
+        # Return the unused tail of the slot to the pool
+        new_start = start + task_duration
+        if end - new_start >= min_needed:
+            free_slots.add((new_start, end))
+
     save_tasks()
 
 # --- Analytics ---
 def calculate_productivity():
     total_tasks = len(st.session_state.tasks)
-    completed_tasks = sum(1 for task in st.session_state.tasks if task["completed"])
-    
     if total_tasks == 0:
         return 0, 0, 0
-    
+
+    completed_tasks = 0
+    total_planned_time = 0
+    actual_time = 0
+    for task in st.session_state.tasks:
+        duration = task["duration"]
+        if task["scheduled"]:
+            total_planned_time += duration
+        if task["completed"]:
+            completed_tasks += 1
+            actual_time += duration
+
     completion_rate = (completed_tasks / total_tasks) * 100
-    
-    total_planned_time = sum(task["duration"] for task in st.session_state.tasks if task["scheduled"])
-    actual_time = sum(task["duration"] for task in st.session_state.tasks if task["completed"])
-    
+
     return completion_rate, total_planned_time, actual_time
 
 # --- Streamlit UI ---
@@ -216,20 +334,19 @@ with col1:
     # Fetch Calendar
     with st.expander("📅 Google Calendar"):
         if st.button("Fetch Calendar Events"):
-            calendar_events.clear()
             try:
-                calendar_events.extend(get_google_calendar_events())
-                if not calendar_events:
+                st.session_state.calendar_events = get_google_calendar_events()
+                if not st.session_state.calendar_events:
                     st.info("No upcoming events found.")
                 else:
-                    st.success(f"Found {len(calendar_events)} events")
+                    st.success(f"Found {len(st.session_state.calendar_events)} events")
             except Exception as e:
                 st.error(f"❌ Failed to fetch calendar: {e}")
 
     # Smart Scheduler
     with st.expander("🧠 Smart Scheduler"):
         if st.button("Schedule Tasks Automatically"):
-            if not calendar_events:
+            if not st.session_state.calendar_events:
                 st.warning("📅 Please fetch calendar first!")
             else:
                 schedule_tasks()
@@ -239,15 +356,18 @@ with col2:
     # Task List
     st.subheader("📝 Your Tasks")
     
+    prioritized_tasks = get_prioritized_tasks()
+
     if not st.session_state.tasks:
         st.info("No tasks yet. Add some tasks to get started!")
     else:
-        for idx, task in enumerate(get_prioritized_tasks()):
+        for idx, task in enumerate(prioritized_tasks):
             task_col1, task_col2, task_col3, task_col4 = st.columns([6, 1, 1, 1])
             with task_col1:
                 if task.get("scheduled") and task.get("start_time"):
-                    start_time = datetime.datetime.fromisoformat(task['start_time']).strftime('%H:%M')
-                    end_time = datetime.datetime.fromisoformat(task['end_time']).strftime('%H:%M')
+                    # Tasks scheduled before start_hhmm existed still need the parse
+                    start_time = task.get('start_hhmm') or _fmt_hhmm(task['start_time'])
+                    end_time = task.get('end_hhmm') or _fmt_hhmm(task['end_time'])
                     st.write(f"🗓 **{task['title']}** | ⏱ {start_time}-{end_time} | 🏷 {task['category']} | 🔢 {task['priority']}")
                 else:
                     st.write(f"🕒 **{task['title']}** | ⏱ {task['duration']}min | 🏷 {task['category']} | 🔢 {task['priority']}")
@@ -286,40 +406,38 @@ with col2:
 
     # Visual Timeline
     st.subheader("🕓 Today's Timeline")
-    if not any(task.get("scheduled") for task in st.session_state.tasks):
+    scheduled_tasks = sorted([t for t in st.session_state.tasks if t.get("scheduled")],
+                             key=itemgetter('start_time'))
+    if not scheduled_tasks:
         st.info("No tasks scheduled yet. Use the Smart Scheduler to arrange your tasks.")
     else:
-        timeline_html = "<div style='margin: 20px 0;'>"
-        for task in sorted([t for t in st.session_state.tasks if t.get("scheduled")], 
-                          key=lambda x: x['start_time']):
-            start = datetime.datetime.fromisoformat(task['start_time'])
-            end = datetime.datetime.fromisoformat(task['end_time'])
-            
-            color_map = {
-                "Work": "#4285F4",
-                "Personal": "#EA4335",
-                "Health": "#34A853",
-                "Learning": "#FBBC05",
-                "Other": "#9E9E9E"
-            }
-            
-            color = color_map.get(task['category'], "#9E9E9E")
-            
-            timeline_html += f"""
-            <div style='background: {color}; color: white; padding: 10px; 
-                        margin-bottom: 5px; border-radius: 5px; 
+        timeline_parts = ["<div style='margin: 20px 0;'>"]
+        for task in scheduled_tasks:
+            start_hhmm = task.get('start_hhmm') or _fmt_hhmm(task['start_time'])
+            end_hhmm = task.get('end_hhmm') or _fmt_hhmm(task['end_time'])
+
+            color = _CATEGORY_COLORS.get(task['category'], _DEFAULT_COLOR)
+
+            timeline_parts.append(f"""
+            <div style='background: {color}; color: white; padding: 10px;
+                        margin-bottom: 5px; border-radius: 5px;
                         {"opacity: 0.6;" if task["completed"] else ""}'>
                 <strong>{task['title']}</strong><br>
-                {start.strftime('%H:%M')}-{end.strftime('%H:%M')} | 
+                {start_hhmm}-{end_hhmm} |
                 {task['duration']}min | Priority: {task['priority']}
             </div>
-            """
-        timeline_html += "</div>"
-        st.markdown(timeline_html, unsafe_allow_html=True)
+            """)
+        timeline_parts.append("</div>")
+        st.markdown("".join(timeline_parts), unsafe_allow_html=True)
 
 # Clear All Tasks
 if st.button("🗑️ Clear All Tasks"):
     st.session_state.tasks.clear()
     save_tasks()
     st.success("All tasks cleared!")
-    st.experimental_rerun()
\ No newline at end of file
+    st.experimental_rerun()
+
+# Flush any edits still pending from the debounce window
+if st.session_state.get('tasks_dirty') and \
+        time.monotonic() - st.session_state.get('last_flush', 0.0) >= 0.5:
+    _flush_tasks()
\ No newline at end of file